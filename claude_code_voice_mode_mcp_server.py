@@ -7,14 +7,20 @@ Custom MCP server providing voice I/O for Claude Code.
 - set_voice(voice): Changes AllTalk voice
 """
 import asyncio
+import collections
 import io
 import json
 import logging
+import queue
+import socket
 import struct
-import tempfile
 import threading
 import time
+import uuid
 import wave
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 from typing import Optional
 
@@ -23,6 +29,31 @@ import requests
 import sounddevice as sd
 from mcp.server import Server
 from mcp.types import TextContent, Tool
+from requests.adapters import HTTPAdapter
+
+try:
+    import webrtcvad
+    HAS_WEBRTCVAD = True
+except ImportError:
+    HAS_WEBRTCVAD = False
+
+try:
+    from scipy.signal import resample_poly
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+try:
+    import soundfile as sf
+    HAS_SOUNDFILE = True
+except ImportError:
+    HAS_SOUNDFILE = False
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -32,161 +63,574 @@ WHISPER_URL = "http://127.0.0.1:8787"
 DEFAULT_VOICE = "Freya.wav"
 SAMPLE_RATE = 16000
 CHANNELS = 1
-VAD_AGGRESSIVENESS = 2  # 0-3, higher = more aggressive filtering
+VAD_AGGRESSIVENESS = 2  # 0-3, higher = more aggressive filtering (webrtcvad second pass)
+VAD_MIN_RMS = 100.0  # Frames quieter than this (int16 RMS) are never speech
+VAD_NOISE_RATIO = 3.0  # Without webrtcvad, speech must be this many times louder than the noise floor
+VAD_NOISE_RISE = 1.05  # Per-frame growth allowed in the noise floor's power (learns steady room noise in ~2 s)
+VAD_MIN_SPEECH_FRAMES = 3  # With webrtcvad, recordings with fewer speech frames (30 ms each) skip Whisper
+VAD_TRIM_PAD = 0.3  # Seconds of audio kept around the first/last speech frame
+PLAYBACK_RATE = 24000  # Output stream rate; buffered audio is resampled to it when scipy is available
+WAV_HEADER_SIZE = 44  # Canonical RIFF/fmt/data header length
+STREAMING_CHUNK_SIZE = 4096  # Bytes read from the TTS response per playback write
+PREROLL_SECONDS = 0.3  # Audio buffered before playback starts, absorbs network jitter
+OUTPUT_IDLE_CLOSE = 5.0  # Seconds of silence before the output stream is closed (so Windows can sleep)
+MIC_IDLE_CLOSE = 30.0  # Seconds without a recording before the mic is released; covers converse's TTS
+WHISPER_RAW_PCM = False  # Upload raw s16le PCM (only for Whisper servers that accept it); falls back to WAV on rejection
+TTS_CACHE_SIZE = 16  # Short utterances kept in memory, keyed by (voice, text)
+TTS_CACHE_MAX_CHARS = 40  # Only phrases up to this length are cached
+HEALTH_TTL = 5.0  # Seconds to reuse /api/ready and /health results
+VOICES_TTL = 60.0  # Seconds to reuse the AllTalk voice list
+WHISPER_ULAW_UPLOAD = False  # Send 8-bit mu-law WAV instead (half the bytes, telephone quality)
 
 LOG_FILE = Path("F:/Apps/freedom_system/log/claude_code_voice_mode.log")
 LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
+# Records are formatted by the QueueHandler and written by a listener
+# thread, so audio callbacks never wait on the console or the log file.
+_log_queue = queue.SimpleQueue()
 logging.basicConfig(
     level=logging.INFO,
     format="[CLAUDE_CODE_VOICE_MODE] [%(levelname)s] %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(str(LOG_FILE), encoding="utf-8"),
-    ],
+    handlers=[QueueHandler(_log_queue)],
+)
+LOG_LISTENER = QueueListener(
+    _log_queue,
+    logging.StreamHandler(),
+    logging.FileHandler(str(LOG_FILE), encoding="utf-8"),
 )
+LOG_LISTENER.start()
 logger = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # Global state
 # ---------------------------------------------------------------------------
-current_voice = DEFAULT_VOICE
-mic_muted = False
-mic_mode = "push_to_talk"  # push_to_talk, toggle, always_on
+@dataclass
+class VoiceState:
+    """Mutable server state, read from the event loop, workers and the audio thread."""
+
+    current_voice: str = DEFAULT_VOICE
+    mic_muted: bool = False
+    mic_mode: str = "push_to_talk"  # push_to_talk, toggle, always_on
+    whisper_raw_pcm: bool = WHISPER_RAW_PCM  # Cleared once Whisper rejects a raw upload
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def set_voice(self, voice: str):
+        with self.lock:
+            self.current_voice = voice
+
+
+STATE = VoiceState()
 STATE_FILE = Path("F:/Apps/freedom_system/REPO_claude_code_voice_mode/mic_state.json")
 
+class LocalServiceAdapter(HTTPAdapter):
+    """HTTPAdapter with socket options suited to the localhost TTS/STT services."""
 
-def is_tts_paused() -> bool:
-    """Check if TTS is paused by reading the shared state file."""
-    try:
-        state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
-        return state.get("tts_paused", False)
-    except Exception:
-        return False
+    SOCKET_OPTIONS = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),  # Don't hold small chunks for ACKs
+        (socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20),  # Room for bursts of streamed audio
+    ]
 
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
 
-def _wait_for_playback_or_pause():
-    """Wait for audio playback to complete, or stop if TTS is paused."""
+
+# Keep-alive connection pool shared by all AllTalk/Whisper requests
+SESSION = requests.Session()
+SESSION.mount("http://", LocalServiceAdapter(pool_connections=2, pool_maxsize=8, max_retries=0))
+
+
+_tts_paused = threading.Event()
+
+
+def _watch_state_file():
+    """Mirror the mic panel's tts_paused flag into _tts_paused, re-reading only on change."""
+    last_mtime = None
     while True:
         try:
-            stream = sd.get_stream()
-            if not stream.active:
-                break
-        except RuntimeError:
-            break
-        if is_tts_paused():
-            sd.stop()
-            logger.info("Playback stopped: TTS paused")
-            break
+            mtime = STATE_FILE.stat().st_mtime_ns
+            if mtime != last_mtime:
+                state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+                if state.get("tts_paused", False):
+                    if not _tts_paused.is_set():
+                        _tts_paused.set()
+                        PLAYER.stop()  # Cut off the current utterance now
+                else:
+                    _tts_paused.clear()
+                last_mtime = mtime
+        except FileNotFoundError:
+            _tts_paused.clear()
+            last_mtime = None
+        except Exception:
+            last_mtime = None  # Caught mid-write, retry next tick
         time.sleep(0.1)
 
 
+def is_tts_paused() -> bool:
+    """Check if TTS is paused via the mic panel (no file I/O, safe on hot paths)."""
+    return _tts_paused.is_set()
+
+
+def _wait_for_playback_or_pause():
+    """
+    Wait for audio playback to complete, or stop if TTS is paused.
+    The state watcher stops PLAYER the moment a pause lands, which sets
+    drained; the timeout only guards against the device stream dying.
+    """
+    if is_tts_paused():
+        PLAYER.stop()
+    while not PLAYER.drained.wait(0.5):
+        if not PLAYER.active:
+            break
+    if is_tts_paused():
+        logger.info("Playback stopped: TTS paused")
+
+
 # ---------------------------------------------------------------------------
 # Audio helpers
 # ---------------------------------------------------------------------------
-def numpy_to_wav_bytes(audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
-    """Convert numpy float32 audio array to WAV bytes."""
-    audio_int16 = (audio * 32767).astype(np.int16)
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(CHANNELS)
-        wf.setsampwidth(2)
-        wf.setframerate(sample_rate)
-        wf.writeframes(audio_int16.tobytes())
-    return buf.getvalue()
+# RIFF/WAVE header for 16-bit PCM: riff, fmt and data chunk fields
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+
+def float_to_int16(audio: np.ndarray) -> np.ndarray:
+    """Convert float32 audio in [-1, 1] to int16 samples."""
+    # Scale in float32 (a Python int multiplier would upcast to float64) and
+    # clip so out-of-range samples saturate instead of wrapping around.
+    scaled = np.multiply(audio, np.float32(32767.0), dtype=np.float32)
+    np.clip(scaled, -32768.0, 32767.0, out=scaled)
+    return scaled.astype(np.int16)
+
+
+def wav_header(data_size: int, sample_rate: int = SAMPLE_RATE, bits: int = 16, audio_format: int = 1) -> bytes:
+    """Build the 44-byte WAV header for data_size bytes of audio (16-bit PCM by default)."""
+    block_align = CHANNELS * bits // 8
+    return _WAV_HEADER.pack(
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, audio_format, CHANNELS, sample_rate, sample_rate * block_align, block_align, bits,
+        b"data", data_size,
+    )
+
+
+def int16_to_ulaw(pcm: np.ndarray) -> np.ndarray:
+    """Encode int16 samples as 8-bit G.711 mu-law (matches audioop.lin2ulaw)."""
+    x = pcm.astype(np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    x = np.minimum(np.minimum(np.abs(x), 8159) + 0x21, 0x1FFF)
+    segment = np.frexp(x)[1] - 6
+    return (((segment << 4) | ((x >> (segment + 1)) & 0x0F)) ^ mask).astype(np.uint8)
+
+
+def _daemon_timer(delay: float, fn, *args) -> threading.Timer:
+    """Start a Timer that won't keep the process alive."""
+    timer = threading.Timer(delay, fn, args=args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class AudioPlayer:
+    """
+    Long-lived callback output stream fed from a queue of int16 PCM chunks.
+    The stream is opened on first use and only reopened when the sample
+    rate or channel count changes, so back-to-back utterances don't pay
+    PortAudio's stream-open cost. After OUTPUT_IDLE_CLOSE seconds without
+    audio it is closed, rather than playing silence for the whole session.
+    """
+
+    def __init__(self):
+        self._stream = None
+        self._format = None  # (sample_rate, channels) of the open stream
+        self._lock = threading.Lock()  # Queue state, shared with the callback
+        self._open_lock = threading.RLock()  # Stream open/close; never held by the callback
+        self._generation = 0  # Bumped by start(), so idle timers from older utterances give up
+        self._idle_timer = None
+        self._drained_at = 0.0
+        self._chunks = collections.deque()
+        self._current = memoryview(b"")  # Partially played head chunk
+        self._queued = 0  # Bytes written since start(), until primed
+        self._preroll_bytes = 0
+        self._primed = False
+        self._ending = False
+        self._stopped = False  # Set by stop(); writes are dropped until start()
+        self.drained = threading.Event()
+        self.drained.set()
+
+    @property
+    def active(self) -> bool:
+        return self._stream is not None and self._stream.active
+
+    def _callback(self, outdata, frames, time_info, status):
+        need = len(outdata)
+        filled = 0
+        with self._lock:
+            if self._primed:
+                while filled < need and (self._current or self._chunks):
+                    if not self._current:
+                        self._current = memoryview(self._chunks.popleft())
+                    n = min(need - filled, len(self._current))
+                    outdata[filled:filled + n] = self._current[:n]
+                    self._current = self._current[n:]
+                    filled += n
+            finished = self._ending and filled == 0
+        if filled < need:
+            outdata[filled:] = bytes(need - filled)
+        if finished and not self.drained.is_set():
+            self._drained_at = time.monotonic()
+            self.drained.set()
+
+    def start(self, sample_rate: int, channels: int, preroll_bytes: int = 0):
+        """Prepare for a new utterance, (re)opening the stream if the format changed."""
+        with self._open_lock:
+            self._generation += 1
+            with self._lock:
+                self._chunks.clear()
+                self._current = memoryview(b"")
+                self._queued = 0
+                self._preroll_bytes = preroll_bytes
+                self._primed = preroll_bytes == 0
+                self._ending = False
+                self._stopped = False
+            self.drained.clear()
+
+            if self._format != (sample_rate, channels) or not self.active:
+                if self._stream is not None:
+                    self._stream.close()
+                self._stream = sd.RawOutputStream(
+                    samplerate=sample_rate,
+                    channels=channels,
+                    dtype="int16",
+                    blocksize=sample_rate // 50,  # 20 ms
+                    callback=self._callback,
+                )
+                self._stream.start()
+                self._format = (sample_rate, channels)
+
+    def write(self, data):
+        """Queue frame-aligned PCM (any bytes-like object) for playback; never blocks."""
+        with self._lock:
+            if self._stopped:
+                return
+            self._chunks.append(data)
+            if not self._primed:
+                # Hold playback until enough audio is queued that a late
+                # network chunk can't underrun the device.
+                self._queued += len(data)
+                self._primed = self._queued >= self._preroll_bytes
+
+    def finish(self):
+        """Mark the end of the utterance; drained is set once it has played."""
+        with self._lock:
+            self._primed = True
+            self._ending = True
+        self._arm_idle_close(OUTPUT_IDLE_CLOSE)
+
+    def stop(self):
+        """
+        Drop any queued audio immediately. Later writes for the same
+        utterance are discarded, so a producer that hasn't noticed the
+        pause yet can't restart the sound.
+        """
+        with self._lock:
+            self._chunks.clear()
+            self._current = memoryview(b"")
+            self._ending = True
+            self._stopped = True
+        if not self.drained.is_set():
+            self._drained_at = time.monotonic()
+            self.drained.set()
+        self._arm_idle_close(OUTPUT_IDLE_CLOSE)
+
+    def _arm_idle_close(self, delay: float):
+        with self._open_lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+            self._idle_timer = _daemon_timer(delay, self._close_if_idle, self._generation)
+
+    def _close_if_idle(self, generation: int):
+        """Close the stream once it has been drained for OUTPUT_IDLE_CLOSE seconds."""
+        with self._open_lock:
+            if generation != self._generation or self._stream is None:
+                return  # A newer utterance owns the stream, or it is already closed
+            if not self.drained.is_set():
+                remaining = OUTPUT_IDLE_CLOSE  # Still playing out; check again later
+            else:
+                remaining = OUTPUT_IDLE_CLOSE - (time.monotonic() - self._drained_at)
+            if remaining > 0:
+                self._arm_idle_close(remaining)
+                return
+            self._stream.close()
+            self._stream = None
+            self._format = None
+            self._idle_timer = None
+        logger.info("Output stream closed after idle")
+
+
+PLAYER = AudioPlayer()
+threading.Thread(target=_watch_state_file, daemon=True).start()
+
+
+class MicCapture:
+    """
+    Long-lived microphone input stream shared by every recording.
+    It is opened on first use (or ahead of time during converse's TTS) and
+    kept running between recordings, so they don't pay PortAudio's
+    device-open cost; after MIC_IDLE_CLOSE seconds without a sink the
+    device is released. Blocks are dropped while no sink is set.
+    """
+
+    def __init__(self):
+        self._stream = None
+        self._sink = None  # Called as sink(indata, frames) from the audio thread
+        self._lock = threading.RLock()  # Stream open/close
+        self._generation = 0  # Bumped on every open()/set_sink(), so older idle timers give up
+        self._idle_timer = None
+
+    @property
+    def active(self) -> bool:
+        return self._stream is not None and self._stream.active
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            logger.warning(f"Audio status: {status}")
+        sink = self._sink
+        if sink is not None:
+            sink(indata, frames)
+
+    def open(self):
+        """Start the input stream if it isn't already running."""
+        with self._lock:
+            self._touch()
+            if self.active:
+                return
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = sd.InputStream(
+                samplerate=SAMPLE_RATE,
+                channels=CHANNELS,
+                dtype="int16",
+                blocksize=SAMPLE_RATE * 30 // 1000,  # One 30 ms VAD frame
+                callback=self._callback,
+            )
+            self._stream.start()
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def set_sink(self, sink):
+        self._sink = sink
+        with self._lock:
+            self._touch()
+
+    def _touch(self):
+        """Restart the idle countdown."""
+        self._generation += 1
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        self._idle_timer = _daemon_timer(MIC_IDLE_CLOSE, self._close_if_idle, self._generation)
+
+    def _close_if_idle(self, generation: int):
+        with self._lock:
+            if generation != self._generation or self._stream is None:
+                return
+            if self._sink is not None:
+                self._touch()  # Still recording; check again later
+                return
+            self.close()
+        logger.info("Microphone released after idle")
+
+
+MIC = MicCapture()
+
+
+def play_audio(audio: np.ndarray, sample_rate: int):
+    """
+    Play int16 audio, blocking until it finishes or TTS is paused.
+    Accepts 1-D (mono) or (frames, channels) arrays.
+    """
+    if sample_rate != PLAYBACK_RATE and HAS_SCIPY:
+        # One polyphase pass keeps the persistent output stream at its rate
+        # instead of reopening it for this clip.
+        resampled = resample_poly(audio.astype(np.float32), PLAYBACK_RATE, sample_rate, axis=0)
+        audio = np.clip(resampled, -32768, 32767).astype(np.int16)
+        sample_rate = PLAYBACK_RATE
+    channels = 1 if audio.ndim == 1 else audio.shape[1]
+    PLAYER.start(sample_rate, channels)
+    # Queue a byte view of the samples rather than a tobytes() copy
+    PLAYER.write(memoryview(np.ascontiguousarray(audio)).cast("B"))
+    PLAYER.finish()
+    _wait_for_playback_or_pause()
+
+
+def _decode_audio(buf: io.BytesIO) -> tuple[np.ndarray, int]:
+    """
+    Decode TTS audio to a sample array and its sample rate.
+    16-bit PCM WAV (what AllTalk returns) is read directly with the wave
+    module; other WAV/FLAC/OGG encodings go through soundfile when it is
+    installed, and anything else falls back to PyAV.
+    """
+    try:
+        with wave.open(buf, "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise wave.Error(f"unsupported sample width {wf.getsampwidth()}")
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+            return pcm.reshape(-1, wf.getnchannels()), wf.getframerate()
+    except (wave.Error, EOFError):
+        buf.seek(0)
+
+    if HAS_SOUNDFILE:
+        try:
+            pcm, rate = sf.read(buf, dtype="int16", always_2d=True)
+            return pcm, rate
+        except RuntimeError:  # LibsndfileError subclasses RuntimeError
+            buf.seek(0)
+
+    import av
+    container = av.open(buf)
+    audio_stream = next(s for s in container.streams if s.type == "audio")
+
+    frames = []
+    target_rate = 24000
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=target_rate)
+    for frame in container.decode(audio_stream):
+        resampled = resampler.resample(frame)
+        for r in resampled:
+            frames.append(r.to_ndarray().flatten())
+
+    if not frames:
+        return np.array([], dtype=np.int16), target_rate
+    return np.concatenate(frames), target_rate
 
 
 def record_audio(duration: float = 5.0, silence_timeout: float = 2.0) -> np.ndarray:
     """
-    Record audio from microphone with Voice Activity Detection.
+    Record int16 audio from microphone with Voice Activity Detection.
     Stops when silence is detected for silence_timeout seconds,
     or when max duration is reached.
-    """
-    import webrtcvad
 
-    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    Frames below an absolute energy floor are silence without further work.
+    The rest are judged by webrtcvad when it is installed, otherwise by
+    energy against a noise floor that follows the quietest recent frames.
+    Leading/trailing silence is trimmed. A recording webrtcvad finds almost
+    no speech in comes back empty so it never reaches Whisper; without
+    webrtcvad such a recording is returned whole, since energy alone can
+    miss a quiet talker.
+    """
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS) if HAS_WEBRTCVAD else None
     frame_duration_ms = 30  # ms per VAD frame
     frame_size = int(SAMPLE_RATE * frame_duration_ms / 1000)
     max_frames = int(duration * SAMPLE_RATE / frame_size)
+    capacity = max_frames * frame_size
     silence_frames_threshold = int(silence_timeout * 1000 / frame_duration_ms)
 
     logger.info(f"Recording... (max {duration}s, silence timeout {silence_timeout}s)")
 
-    all_frames = []
+    # Flat sample buffer filled in place by the audio callback; any block
+    # size works and the final conversion is a single slice, no concatenate.
+    recording = np.empty(capacity, dtype=np.int16)
+    write_idx = 0
+    checked_idx = 0
+    frame_ready = threading.Event()
     silence_count = 0
     speech_detected = False
+    speech_frames = 0
+    first_speech = 0  # Sample index where the first speech frame starts
+    last_speech_end = 0  # Sample index where the last speech frame ends
+    # Energy gate works on mean-square power, so compare against squared thresholds
+    noise_ratio_sq = VAD_NOISE_RATIO ** 2
+    min_power = VAD_MIN_RMS ** 2
+    noise_power = min_power / noise_ratio_sq  # Starts where it doesn't raise the threshold
 
-    def audio_callback(indata, frames, time_info, status):
-        nonlocal silence_count, speech_detected
-        if status:
-            logger.warning(f"Audio status: {status}")
-        if mic_muted:
+    def audio_callback(indata, frames):
+        nonlocal write_idx
+        if STATE.mic_muted or write_idx >= capacity:
             return
-        all_frames.append(indata.copy())
-
-    with sd.InputStream(
-        samplerate=SAMPLE_RATE,
-        channels=CHANNELS,
-        dtype="int16",
-        blocksize=frame_size,
-        callback=audio_callback,
-    ):
-        for _ in range(max_frames):
-            sd.sleep(frame_duration_ms)
-            if not all_frames:
-                continue
+        n = min(frames, capacity - write_idx)
+        recording[write_idx:write_idx + n] = indata[:n, 0]
+        write_idx += n
+        frame_ready.set()
+
+    MIC.open()  # No-op once the stream is running
+    MIC.set_sink(audio_callback)
+    try:
+        # Wake as soon as the callback delivers a frame rather than on a
+        # fixed sleep; the deadline still bounds the loop while muted.
+        deadline = time.monotonic() + duration
+        while write_idx < capacity and time.monotonic() < deadline:
+            frame_ready.wait(timeout=0.05)
+            frame_ready.clear()
+            end = write_idx
+            silence_reached = False
 
-            # Check last frame for voice activity
-            last_frame = all_frames[-1].flatten().tobytes()
-            if len(last_frame) == frame_size * 2:  # 2 bytes per int16 sample
-                is_speech = vad.is_speech(last_frame, SAMPLE_RATE)
+            # Score every whole frame written since the last wakeup, so the
+            # silence count stays exact even if this loop falls behind.
+            while checked_idx + frame_size <= end:
+                frame = recording[checked_idx:checked_idx + frame_size]
+                checked_idx += frame_size
+                wide = frame.astype(np.int64)
+                power = int(np.dot(wide, wide)) / frame_size  # Mean square; no sqrt needed
+                # Slowly rising minimum: drops to any quieter frame at once,
+                # climbs only gradually, so steady room noise is learned
+                # whether or not frames are judged to be speech.
+                noise_power = min(power, noise_power * VAD_NOISE_RISE)
+                if power <= min_power:
+                    is_speech = False
+                elif vad is not None:
+                    is_speech = vad.is_speech(frame.tobytes(), SAMPLE_RATE)
+                else:
+                    is_speech = power > noise_power * noise_ratio_sq
                 if is_speech:
+                    if not speech_detected:
+                        first_speech = checked_idx - frame_size
                     speech_detected = True
+                    speech_frames += 1
+                    last_speech_end = checked_idx
                     silence_count = 0
                 else:
                     silence_count += 1
 
                 # Stop if we had speech and now have enough silence
                 if speech_detected and silence_count >= silence_frames_threshold:
-                    logger.info("Silence detected, stopping recording.")
+                    silence_reached = True
                     break
 
-    if not all_frames:
-        return np.array([], dtype=np.float32)
+            if silence_reached:
+                logger.info("Silence detected, stopping recording.")
+                break
+    finally:
+        MIC.set_sink(None)
 
-    audio = np.concatenate(all_frames).flatten().astype(np.float32) / 32768.0
+    # Hand back the captured int16 samples as-is; Whisper uploads are int16
+    # too, so a float round trip would only cost two passes.
+    if speech_frames >= VAD_MIN_SPEECH_FRAMES:
+        pad = int(VAD_TRIM_PAD * SAMPLE_RATE)
+        audio = recording[max(0, first_speech - pad):min(write_idx, last_speech_end + pad)]
+    elif vad is not None:
+        logger.info(f"No speech detected ({speech_frames} speech frames), skipping transcription")
+        return np.array([], dtype=np.int16)
+    else:
+        audio = recording[:write_idx]  # Let Whisper judge what the energy check couldn't
     logger.info(f"Recorded {len(audio) / SAMPLE_RATE:.1f}s of audio")
     return audio
 
 
 def play_audio_from_url(url: str):
-    """Download audio from URL and play it through speakers."""
+    """
+    Download audio from URL and play it through speakers.
+    16-bit PCM WAV plays while it downloads; other formats are fetched
+    whole and decoded in memory.
+    """
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-
-        # Write to temp file and play
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            tmp.write(response.content)
-            tmp_path = tmp.name
-
-        import av
-        container = av.open(tmp_path)
-        audio_stream = next(s for s in container.streams if s.type == "audio")
-
-        frames = []
-        resampler = av.AudioResampler(format="s16", layout="mono", rate=24000)
-        for frame in container.decode(audio_stream):
-            resampled = resampler.resample(frame)
-            for r in resampled:
-                frames.append(r.to_ndarray().flatten())
-
-        if frames:
-            audio = np.concatenate(frames).astype(np.float32) / 32768.0
-            sd.play(audio, samplerate=24000)
-            _wait_for_playback_or_pause()
-
-        Path(tmp_path).unlink(missing_ok=True)
+        with SESSION.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            try:
+                play_wav_stream(response)
+            except WavStreamError as e:
+                logger.info(f"Not streamable ({e}), decoding full download")
+                play_audio_bytes(e.head + response.raw.read())
     except Exception as e:
         logger.error(f"Audio playback failed: {e}")
 
@@ -194,41 +638,171 @@ def play_audio_from_url(url: str):
 def play_audio_bytes(audio_bytes: bytes):
     """Play raw audio bytes (WAV format) through speakers."""
     try:
-        buf = io.BytesIO(audio_bytes)
-        import av
-        container = av.open(buf)
-        audio_stream = next(s for s in container.streams if s.type == "audio")
-
-        frames = []
-        target_rate = 24000
-        resampler = av.AudioResampler(format="s16", layout="mono", rate=target_rate)
-        for frame in container.decode(audio_stream):
-            resampled = resampler.resample(frame)
-            for r in resampled:
-                frames.append(r.to_ndarray().flatten())
-
-        if frames:
-            audio = np.concatenate(frames).astype(np.float32) / 32768.0
-            sd.play(audio, samplerate=target_rate)
-            _wait_for_playback_or_pause()
+        audio, sample_rate = _decode_audio(io.BytesIO(audio_bytes))
+        if len(audio):
+            play_audio(audio, sample_rate)
     except Exception as e:
         logger.error(f"Audio playback failed: {e}")
 
 
+class WavStreamError(ValueError):
+    """A response body that can't be streamed as 16-bit PCM WAV; head holds the bytes already read."""
+
+    def __init__(self, message: str, head: bytes):
+        super().__init__(message)
+        self.head = head
+
+
+def _read_wav_header(raw) -> tuple[int, int, int, bytes]:
+    """
+    Read a WAV header from a byte stream, stopping at the start of the PCM data.
+    Returns (sample_rate, channels, sample_width, leftover) where leftover is
+    any PCM data read past the header. Raises WavStreamError otherwise.
+    """
+    header = raw.read(WAV_HEADER_SIZE)
+
+    def fill(size):
+        nonlocal header
+        while len(header) < size:
+            more = raw.read(size - len(header))
+            if not more:
+                raise WavStreamError("WAV stream ended inside the header", header)
+            header += more
+
+    fill(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise WavStreamError("Response is not a WAV stream", header)
+
+    fmt = None
+    pos = 12
+    while True:
+        fill(pos + 8)
+        chunk_id, size = struct.unpack_from("<4sI", header, pos)
+        pos += 8
+        if chunk_id == b"data":
+            break
+        end = pos + size + (size & 1)  # Chunks are word-aligned
+        fill(end)
+        if chunk_id == b"fmt ":
+            fmt = struct.unpack_from("<HHIIHH", header, pos)
+        pos = end
+
+    if fmt is None:
+        raise WavStreamError("WAV stream has no fmt chunk", header)
+    audio_format, channels, sample_rate, _, _, bits = fmt
+    if audio_format not in (1, 0xFFFE) or bits != 16:
+        raise WavStreamError(f"Unsupported WAV format {audio_format} ({bits}-bit)", header)
+    return sample_rate, channels, bits // 8, header[pos:]
+
+
+def _drain_response(raw, chunks: queue.SimpleQueue):
+    """Read a streamed response body into a queue, ending with None or the error raised."""
+    try:
+        while True:
+            chunk = raw.read(STREAMING_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.put(chunk)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+
+def play_wav_stream(response: requests.Response):
+    """
+    Play a streamed WAV response while it downloads.
+    Raises WavStreamError before any playback if the body is not 16-bit PCM WAV.
+    """
+    raw = response.raw
+    raw.decode_content = True
+    sample_rate, channels, sample_width, leftover = _read_wav_header(raw)
+    frame_size = channels * sample_width
+    pending = bytearray(leftover)  # Bytes not yet forming a whole frame
+
+    try:
+        PLAYER.start(sample_rate, channels, int(PREROLL_SECONDS * sample_rate) * frame_size)
+        # Download on a separate thread so a slow response can't delay
+        # noticing a pause; closing the response ends the reader.
+        chunks = queue.SimpleQueue()
+        threading.Thread(target=_drain_response, args=(raw, chunks), daemon=True).start()
+        while True:
+            if is_tts_paused():
+                PLAYER.stop()
+                logger.info("Playback stopped: TTS paused")
+                return
+            try:
+                chunk = chunks.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not pending and len(chunk) % frame_size == 0:
+                # Common case: AllTalk's mono 16-bit chunks arrive frame-aligned
+                PLAYER.write(chunk)
+                continue
+            pending += chunk
+            usable = len(pending) - (len(pending) % frame_size)
+            if usable:
+                PLAYER.write(memoryview(pending)[:usable].tobytes())
+                del pending[:usable]
+        PLAYER.finish()
+        _wait_for_playback_or_pause()
+    except Exception as e:
+        PLAYER.stop()
+        logger.error(f"Audio playback failed: {e}")
+
+
 # ---------------------------------------------------------------------------
 # TTS: Send text to AllTalk
 # ---------------------------------------------------------------------------
-def speak_text(text: str, voice: Optional[str] = None) -> dict:
-    """Send text to AllTalk TTS and play the result."""
+_tts_cache: collections.OrderedDict[tuple[str, str], bytes] = collections.OrderedDict()
+_tts_cache_lock = threading.Lock()  # speak_text runs on several EXECUTOR workers
+
+
+def _cached_tts(key: tuple[str, str]) -> Optional[bytes]:
+    """Return a cached utterance's audio and mark it recently used, or None."""
+    with _tts_cache_lock:
+        audio_bytes = _tts_cache.get(key)
+        if audio_bytes is not None:
+            _tts_cache.move_to_end(key)
+        return audio_bytes
+
+
+def _remember_tts(key: tuple[str, str], audio_bytes: bytes):
+    """Store a short utterance's audio, evicting the least recently used."""
+    with _tts_cache_lock:
+        _tts_cache[key] = audio_bytes
+        _tts_cache.move_to_end(key)
+        if len(_tts_cache) > TTS_CACHE_SIZE:
+            _tts_cache.popitem(last=False)
+
+
+def speak_text(text: str, voice: Optional[str] = None, use_cache: bool = True) -> dict:
+    """
+    Send text to AllTalk TTS and play the result.
+    Short phrases ("ok", "done", ...) are kept in a small LRU and replayed
+    from memory without contacting AllTalk.
+    """
     if is_tts_paused():
         logger.info("TTS is paused, skipping speech")
         return {"status": "paused", "message": "TTS is currently paused via mic panel"}
-    voice = voice or current_voice
+    if not text.strip():
+        return {"status": "skipped", "message": "No text to speak"}
+    voice = voice or STATE.current_voice
     logger.info(f"Speaking: '{text[:80]}...' with voice={voice}")
 
+    key = (voice, text)
+    cacheable = use_cache and len(text) <= TTS_CACHE_MAX_CHARS
+    cached = _cached_tts(key) if cacheable else None
+    if cached is not None:
+        play_audio_bytes(cached)
+        return {"status": "spoken", "voice": voice, "length": len(text), "cached": True}
+
     # Try OpenAI-compatible endpoint first
     try:
-        response = requests.post(
+        response = SESSION.post(
             f"{ALLTALK_URL}/v1/audio/speech",
             json={
                 "input": text,
@@ -237,10 +811,23 @@ def speak_text(text: str, voice: Optional[str] = None) -> dict:
                 "response_format": "wav",
             },
             timeout=30,
+            stream=True,
         )
-        if response.status_code == 200:
-            play_audio_bytes(response.content)
-            return {"status": "spoken", "voice": voice, "length": len(text)}
+        with response:
+            if response.status_code == 200:
+                if cacheable:
+                    # Short clip: take it whole so it can be replayed later
+                    audio_bytes = response.content
+                    _remember_tts(key, audio_bytes)
+                    play_audio_bytes(audio_bytes)
+                else:
+                    try:
+                        play_wav_stream(response)
+                    except WavStreamError as e:
+                        # Decode what was already generated rather than POSTing again
+                        logger.info(f"Not streamable ({e}), decoding full response")
+                        play_audio_bytes(e.head + response.raw.read())
+                return {"status": "spoken", "voice": voice, "length": len(text)}
     except Exception as e:
         logger.warning(f"OpenAI endpoint failed, trying legacy: {e}")
 
@@ -263,7 +850,7 @@ def speak_text(text: str, voice: Optional[str] = None) -> dict:
             "temperature": "0.75",
             "repetition_penalty": "1.0",
         }
-        response = requests.post(
+        response = SESSION.post(
             f"{ALLTALK_URL}/api/tts-generate",
             data=payload,
             timeout=30,
@@ -285,18 +872,68 @@ def speak_text(text: str, voice: Optional[str] = None) -> dict:
 # ---------------------------------------------------------------------------
 # STT: Send audio to Whisper
 # ---------------------------------------------------------------------------
+def _post_transcription(filename: str, parts: list, content_type: str, extra: Optional[dict] = None):
+    """
+    POST one audio file to Whisper's OpenAI-compatible endpoint.
+    parts are bytes-like pieces of the file (e.g. header and PCM array);
+    the multipart body is assembled with a single join, so the audio is
+    copied once instead of once per layer.
+    """
+    boundary = uuid.uuid4().hex
+    fields = {"model": "whisper-1", "language": "en", **(extra or {})}
+    head = "".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'
+        for key, value in fields.items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    )
+    body = b"".join([head.encode(), *parts, f"\r\n--{boundary}--\r\n".encode()])
+    return SESSION.post(
+        f"{WHISPER_URL}/v1/audio/transcriptions",
+        data=body,
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        timeout=30,
+    )
+
+
 def transcribe_audio(audio: np.ndarray) -> str:
     """Send audio to Whisper STT and return transcribed text."""
-    wav_bytes = numpy_to_wav_bytes(audio)
-    logger.info(f"Sending {len(wav_bytes)} bytes to Whisper STT...")
+    pcm_int16 = audio if audio.dtype == np.int16 else float_to_int16(audio)
 
+    if WHISPER_ULAW_UPLOAD:
+        ulaw = int16_to_ulaw(pcm_int16)
+        logger.info(f"Sending {ulaw.nbytes + WAV_HEADER_SIZE} bytes of mu-law audio to Whisper STT...")
+        try:
+            response = _post_transcription(
+                "recording.wav", [wav_header(ulaw.nbytes, bits=8, audio_format=7), ulaw], "audio/wav",
+            )
+            if response.status_code == 200:
+                text = response.json().get("text", "").strip()
+                logger.info(f"Transcribed: '{text}'")
+                return text
+            logger.warning(f"Whisper rejected mu-law ({response.status_code}), retrying as PCM")
+        except Exception as e:
+            logger.warning(f"Mu-law upload failed, retrying as PCM: {e}")
+
+    pcm_size = pcm_int16.nbytes
     try:
-        response = requests.post(
-            f"{WHISPER_URL}/v1/audio/transcriptions",
-            files={"file": ("recording.wav", wav_bytes, "audio/wav")},
-            data={"model": "whisper-1", "language": "en"},
-            timeout=30,
-        )
+        response = None
+        if STATE.whisper_raw_pcm:
+            logger.info(f"Sending {pcm_size} bytes of raw PCM to Whisper STT...")
+            response = _post_transcription(
+                "recording.raw", [pcm_int16], "application/octet-stream",
+                {"sample_rate": SAMPLE_RATE, "channels": CHANNELS, "format": "s16le"},
+            )
+            if response.status_code != 200:
+                logger.info(f"Whisper rejected raw PCM ({response.status_code}), using WAV uploads")
+                STATE.whisper_raw_pcm = False
+                response = None
+        if response is None:
+            logger.info(f"Sending {pcm_size + WAV_HEADER_SIZE} bytes to Whisper STT...")
+            response = _post_transcription("recording.wav", [wav_header(pcm_size), pcm_int16], "audio/wav")
+
         if response.status_code == 200:
             result = response.json()
             text = result.get("text", "").strip()
@@ -310,11 +947,71 @@ def transcribe_audio(audio: np.ndarray) -> str:
         return ""
 
 
+# ---------------------------------------------------------------------------
+# Service health
+# ---------------------------------------------------------------------------
+_probe_cache: dict[str, tuple[float, dict]] = {}
+
+
+def _cached_get(url: str, ttl: float) -> dict:
+    """
+    GET a service URL, reusing the result for ttl seconds.
+    Returns {"status": code, "body": parsed JSON or None}. If a refresh fails
+    but an earlier result exists, that result is returned with "stale": True.
+    """
+    now = time.monotonic()
+    cached = _probe_cache.get(url)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    try:
+        r = SESSION.get(url, timeout=3)
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+        result = {"status": r.status_code, "body": body}
+    except Exception:
+        if cached:
+            return {**cached[1], "stale": True}
+        raise
+    _probe_cache[url] = (now, result)
+    return result
+
+
+def _describe_probe(result: dict) -> str:
+    """Summarize a health probe result for voice_status."""
+    text = "ready" if result["status"] == 200 else f"error ({result['status']})"
+    return f"{text} (stale)" if result.get("stale") else text
+
+
 # ---------------------------------------------------------------------------
 # MCP Server
 # ---------------------------------------------------------------------------
 server = Server("claude-code-voice-mode")
 
+# Long-lived workers for blocking audio/HTTP calls; unlike asyncio.to_thread
+# this skips the per-call context copy and keeps thread identity stable.
+EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="voice")
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking function on EXECUTOR and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, fn, *args)
+
+
+def to_json(obj, indent: bool = False) -> str:
+    """Serialize a tool result, with orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    return json.dumps(obj, indent=2 if indent else None)
+
+
+# Fixed replies are built once and shared
+NO_AUDIO_REPLY = [TextContent(type="text", text="No audio captured.")]
+NO_RESPONSE_REPLY = [TextContent(type="text", text="No response heard.")]
+UNTRANSCRIBED_AUDIO_REPLY = [TextContent(type="text", text="Could not transcribe audio.")]
+UNTRANSCRIBED_RESPONSE_REPLY = [TextContent(type="text", text="Could not transcribe response.")]
+
 
 @server.list_tools()
 async def list_tools():
@@ -397,67 +1094,89 @@ async def list_tools():
     ]
 
 
+async def _handle_speak(arguments: dict):
+    text = arguments.get("text", "")
+    voice = arguments.get("voice")
+    result = await run_blocking(speak_text, text, voice)
+    return [TextContent(type="text", text=to_json(result))]
+
+
+async def _handle_listen(arguments: dict):
+    duration = arguments.get("duration", 10.0)
+    silence_timeout = arguments.get("silence_timeout", 2.0)
+    audio = await run_blocking(record_audio, duration, silence_timeout)
+    if len(audio) == 0:
+        return NO_AUDIO_REPLY
+    text = await run_blocking(transcribe_audio, audio)
+    if not text:
+        return UNTRANSCRIBED_AUDIO_REPLY
+    return [TextContent(type="text", text=text)]
+
+
+async def _handle_converse(arguments: dict):
+    message = arguments.get("message", "")
+    listen_duration = arguments.get("listen_duration", 10.0)
+
+    # Speak the message first, opening the mic meanwhile so recording
+    # starts without device-open latency once playback ends
+    if message:
+        await asyncio.gather(run_blocking(speak_text, message), run_blocking(MIC.open))
+
+    # Then listen for response
+    audio = await run_blocking(record_audio, listen_duration, 2.0)
+    if len(audio) == 0:
+        return NO_RESPONSE_REPLY
+    text = await run_blocking(transcribe_audio, audio)
+    if not text:
+        return UNTRANSCRIBED_RESPONSE_REPLY
+    return [TextContent(type="text", text=text)]
+
+
+async def _handle_set_voice(arguments: dict):
+    voice = arguments.get("voice", DEFAULT_VOICE)
+    STATE.set_voice(voice)
+    logger.info(f"Voice changed to: {voice}")
+    return [TextContent(type="text", text=f"Voice set to: {voice}")]
+
+
+async def _handle_voice_status(arguments: dict):
+    status = {"alltalk": "unknown", "whisper": "unknown", "voice": STATE.current_voice, "voices": [], "tts_paused": is_tts_paused()}
+    # Probe concurrently: total wait is the slowest service, not the sum
+    ready, health, voices = await asyncio.gather(
+        run_blocking(_cached_get, f"{ALLTALK_URL}/api/ready", HEALTH_TTL),
+        run_blocking(_cached_get, f"{WHISPER_URL}/health", HEALTH_TTL),
+        run_blocking(_cached_get, f"{ALLTALK_URL}/api/voices", VOICES_TTL),
+        return_exceptions=True,
+    )
+    for key, result in (("alltalk", ready), ("whisper", health)):
+        if isinstance(result, Exception):
+            status[key] = f"offline ({result})"
+        else:
+            status[key] = _describe_probe(result)
+    if not isinstance(voices, Exception) and voices["status"] == 200:
+        body = voices["body"]
+        if isinstance(body, list):
+            status["voices"] = body
+        elif isinstance(body, dict):
+            status["voices"] = body.get("voices", [])
+    return [TextContent(type="text", text=to_json(status, indent=True))]
+
+
+_HANDLERS = {
+    "speak": _handle_speak,
+    "listen": _handle_listen,
+    "converse": _handle_converse,
+    "set_voice": _handle_set_voice,
+    "voice_status": _handle_voice_status,
+}
+
+
 @server.call_tool()
 async def call_tool(name: str, arguments: dict):
-    global current_voice
-
-    if name == "speak":
-        text = arguments.get("text", "")
-        voice = arguments.get("voice")
-        result = await asyncio.to_thread(speak_text, text, voice)
-        return [TextContent(type="text", text=json.dumps(result))]
-
-    elif name == "listen":
-        duration = arguments.get("duration", 10.0)
-        silence_timeout = arguments.get("silence_timeout", 2.0)
-        audio = await asyncio.to_thread(record_audio, duration, silence_timeout)
-        if len(audio) == 0:
-            return [TextContent(type="text", text="No audio captured.")]
-        text = await asyncio.to_thread(transcribe_audio, audio)
-        return [TextContent(type="text", text=text if text else "Could not transcribe audio.")]
-
-    elif name == "converse":
-        message = arguments.get("message", "")
-        listen_duration = arguments.get("listen_duration", 10.0)
-
-        # Speak the message first
-        if message:
-            await asyncio.to_thread(speak_text, message)
-
-        # Then listen for response
-        audio = await asyncio.to_thread(record_audio, listen_duration, 2.0)
-        if len(audio) == 0:
-            return [TextContent(type="text", text="No response heard.")]
-        text = await asyncio.to_thread(transcribe_audio, audio)
-        return [TextContent(type="text", text=text if text else "Could not transcribe response.")]
-
-    elif name == "set_voice":
-        voice = arguments.get("voice", DEFAULT_VOICE)
-        current_voice = voice
-        logger.info(f"Voice changed to: {current_voice}")
-        return [TextContent(type="text", text=f"Voice set to: {current_voice}")]
-
-    elif name == "voice_status":
-        status = {"alltalk": "unknown", "whisper": "unknown", "voice": current_voice, "voices": [], "tts_paused": is_tts_paused()}
-        try:
-            r = requests.get(f"{ALLTALK_URL}/api/ready", timeout=3)
-            status["alltalk"] = "ready" if r.status_code == 200 else f"error ({r.status_code})"
-        except Exception as e:
-            status["alltalk"] = f"offline ({e})"
-        try:
-            r = requests.get(f"{WHISPER_URL}/health", timeout=3)
-            status["whisper"] = "ready" if r.status_code == 200 else f"error ({r.status_code})"
-        except Exception as e:
-            status["whisper"] = f"offline ({e})"
-        try:
-            r = requests.get(f"{ALLTALK_URL}/api/voices", timeout=3)
-            if r.status_code == 200:
-                status["voices"] = r.json() if isinstance(r.json(), list) else r.json().get("voices", [])
-        except Exception:
-            pass
-        return [TextContent(type="text", text=json.dumps(status, indent=2))]
-
-    return [TextContent(type="text", text=f"Unknown tool: {name}")]
+    handler = _HANDLERS.get(name)
+    if handler is None:
+        return [TextContent(type="text", text=f"Unknown tool: {name}")]
+    return await handler(arguments)
 
 
 async def main():
@@ -468,8 +1187,11 @@ async def main():
     logger.info(f"Whisper STT: {WHISPER_URL}")
     logger.info(f"Default voice: {DEFAULT_VOICE}")
 
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(read_stream, write_stream, server.create_initialization_options())
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(read_stream, write_stream, server.create_initialization_options())
+    finally:
+        LOG_LISTENER.stop()  # Flush queued records before exit
 
 
 if __name__ == "__main__":
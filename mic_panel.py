@@ -9,6 +9,7 @@ Always-on-top floating window with:
 """
 import json
 import logging
+import math
 import os
 import queue
 import socket
@@ -23,6 +24,7 @@ from pathlib import Path
 import numpy as np
 import requests
 import sounddevice as sd
+from requests.adapters import HTTPAdapter
 
 try:
     import pystray
@@ -31,16 +33,29 @@ try:
 except ImportError:
     HAS_TRAY = False
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
+ALLTALK_URL = "http://127.0.0.1:7851"
 WHISPER_URL = "http://127.0.0.1:8787"
 SAMPLE_RATE = 16000
 CHANNELS = 1
+LEVEL_BLOCKSIZE = 512  # 32 ms per meter update
+TICK_MS = 250  # Period of the panel's single UI timer
 STATE_FILE = Path("F:/Apps/freedom_system/REPO_claude_code_voice_mode/mic_state.json")
 LOG_FILE = Path("F:/Apps/freedom_system/log/claude_code_voice_mode_mic_panel.log")
 LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
 
+# Keep-alive connection to AllTalk for pause requests
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
 LOG_FORMAT = "[MIC_PANEL] [%(levelname)s] %(message)s"
 logging.basicConfig(
     level=logging.INFO,
@@ -53,19 +68,39 @@ logger = logging.getLogger(__name__)
 
 
 class TextHandler(logging.Handler):
-    """Logging handler that writes to a tkinter Text widget (thread-safe)."""
+    """
+    Logging handler that writes to a tkinter Text widget (thread-safe).
+    Records are queued from any thread; the panel's tick calls drain() on
+    the Tk thread, so a burst of logs is a single widget update.
+    """
 
-    def __init__(self, text_widget):
+    def __init__(self, text_widget, max_lines: int = 500):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.pending = queue.SimpleQueue()
 
     def emit(self, record):
-        msg = self.format(record) + "\n"
-        self.text_widget.after(0, self._append, msg)
+        self.pending.put(self.format(record) + "\n")
+
+    def drain(self):
+        """Insert all queued lines at once (Tk thread only)."""
+        lines = []
+        while True:
+            try:
+                lines.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self._append("".join(lines))
 
     def _append(self, msg):
         self.text_widget.config(state=tk.NORMAL)
         self.text_widget.insert(tk.END, msg)
+        # Keep only the newest max_lines lines so the widget doesn't grow all day
+        lines = int(self.text_widget.index("end-1c").split(".")[0]) - 1  # Last line is the empty one after "\n"
+        if lines > self.max_lines:
+            self.text_widget.delete("1.0", f"{lines - self.max_lines + 1}.0")
         self.text_widget.see(tk.END)
         self.text_widget.config(state=tk.DISABLED)
 
@@ -73,12 +108,22 @@ class TextHandler(logging.Handler):
 # ---------------------------------------------------------------------------
 # Shared mic state (read by MCP server)
 # ---------------------------------------------------------------------------
-def save_mic_state(state: dict):
-    """Save mic state to file for MCP server to read."""
+def save_mic_state(state: dict) -> bool:
+    """
+    Save mic state to file for MCP server to read.
+    Written to a temp file and swapped in, so readers never see a partial write.
+    """
+    tmp = STATE_FILE.with_suffix(".tmp")
     try:
-        STATE_FILE.write_text(json.dumps(state), encoding="utf-8")
+        if HAS_ORJSON:
+            tmp.write_bytes(orjson.dumps(state))
+        else:
+            tmp.write_text(json.dumps(state), encoding="utf-8")
+        os.replace(tmp, STATE_FILE)
+        return True
     except Exception as e:
         logger.error(f"Failed to save mic state: {e}")
+        return False
 
 
 def create_tray_icon_image(color="green"):
@@ -96,6 +141,50 @@ def create_tray_icon_image(color="green"):
     return img
 
 
+# Rendered once; minimizing to the tray just looks the image up
+TRAY_ICONS = {c: create_tray_icon_image(c) for c in ("green", "red", "yellow", "gray")} if HAS_TRAY else {}
+
+
+def block_rms(samples: np.ndarray, scratch: np.ndarray = None) -> float:
+    """
+    RMS of a block of int16 samples, normalized to 0..1 full scale.
+    The squares are taken in int32 (int16^2 always fits) into scratch when
+    it is large enough, so no float copy is made.
+    """
+    x = samples.reshape(-1)
+    if scratch is None or len(scratch) < len(x):
+        scratch = np.empty(len(x), dtype=np.int32)
+    squares = np.multiply(x, x, out=scratch[:len(x)], dtype=np.int32)
+    return math.sqrt(int(squares.sum(dtype=np.int64)) / len(x)) / 32768.0
+
+
+def input_stream_settings() -> dict:
+    """
+    Extra InputStream arguments selecting the WASAPI default input on Windows.
+    WASAPI has far less input latency than the MME default; auto_convert lets
+    it deliver SAMPLE_RATE regardless of the device's mix format. Returns an
+    empty dict (PortAudio's default device) where WASAPI isn't available.
+    """
+    try:
+        for api in sd.query_hostapis():
+            if api["name"] == "Windows WASAPI" and api["default_input_device"] >= 0:
+                return {
+                    "device": api["default_input_device"],
+                    "extra_settings": sd.WasapiSettings(auto_convert=True),
+                }
+    except Exception as e:
+        logger.warning(f"Host API query failed, using default input: {e}")
+    return {}
+
+
+def stop_alltalk_generation():
+    """Ask AllTalk to abandon the utterance it is generating."""
+    try:
+        SESSION.put(f"{ALLTALK_URL}/api/stop-generation", timeout=2)
+    except Exception as e:
+        logger.warning(f"Failed to stop AllTalk generation: {e}")
+
+
 class MicControlPanel:
     def __init__(self):
         self.root = tk.Tk()
@@ -110,15 +199,22 @@ class MicControlPanel:
         self.is_recording = False
         self.is_muted = False
         self.volume = tk.DoubleVar(value=1.0)
-        self.audio_queue = queue.Queue()
+        self._volume_cache = 1.0  # Plain copy of volume for the audio thread (Tk vars aren't thread-safe)
         self.audio_stream = None
         self.level_value = 0.0
+        self._last_pushed_level = 0.0  # Last value sent to the meter via <<Level>>
+        self._rms_scratch = np.empty(LEVEL_BLOCKSIZE, dtype=np.int32)  # Reused by every level callback
+        self._monitor_stop = threading.Event()
         self.tray_icon = None
         self.hidden = False
         self.tts_paused = False
+        self._pending_state = None  # Latest state waiting for the writer thread
+        self._state_dirty = threading.Event()
+        self._last_saved_state = None  # What the file currently holds
 
         self._build_ui()
         self._setup_console_logging()
+        threading.Thread(target=self._state_writer, daemon=True).start()
         self._update_state()
         self._start_level_monitor()
 
@@ -311,6 +407,10 @@ class MicControlPanel:
 
     def _on_volume_change(self, value):
         """Handle volume slider change."""
+        volume = float(value)
+        if volume == self._volume_cache:
+            return  # Drag within one slider step; nothing to save
+        self._volume_cache = volume
         self._update_state()
 
     def _toggle_tts_pause(self):
@@ -319,10 +419,8 @@ class MicControlPanel:
         if self.tts_paused:
             self.tts_pause_btn.config(text="Continue TTS", bg="#4CAF50")
             logger.info("TTS paused")
-            try:
-                requests.put("http://127.0.0.1:7851/api/stop-generation", timeout=2)
-            except Exception as e:
-                logger.warning(f"Failed to stop AllTalk generation: {e}")
+            # Off the Tk thread: a slow AllTalk must not freeze the panel
+            threading.Thread(target=stop_alltalk_generation, daemon=True).start()
         else:
             self.tts_pause_btn.config(text="Pause TTS", bg="#FF9800")
             logger.info("TTS resumed")
@@ -330,49 +428,87 @@ class MicControlPanel:
 
     def _setup_console_logging(self):
         """Attach a TextHandler to the logger so logs appear in the embedded console."""
-        handler = TextHandler(self.console_text)
-        handler.setFormatter(logging.Formatter(LOG_FORMAT))
-        logger.addHandler(handler)
+        self.console_handler = TextHandler(self.console_text)
+        self.console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(self.console_handler)
+
+    def _tick(self):
+        """All periodic UI work, on one timer so the Tk loop wakes rarely."""
+        self.console_handler.drain()
+        self.root.after(TICK_MS, self._tick)
 
     def _update_state(self):
-        """Save current state to file for MCP server."""
-        state = {
+        """Queue current state for the writer thread to save for the MCP server."""
+        self._pending_state = {
             "mode": self.mode.get(),
             "recording": self.is_recording,
             "muted": self.is_muted,
-            "volume": self.volume.get(),
+            "volume": round(self._volume_cache, 3),
             "tts_paused": self.tts_paused,
         }
-        save_mic_state(state)
+        self._state_dirty.set()
+
+    def _state_writer(self):
+        """Write queued state at most every 100 ms, so a slider drag costs one write."""
+        while True:
+            self._state_dirty.wait()
+            time.sleep(0.1)  # Let a burst of updates coalesce
+            self._state_dirty.clear()
+            state = self._pending_state
+            if state == self._last_saved_state:
+                continue  # e.g. a slider drag that ended where it started
+            if save_mic_state(state):
+                self._last_saved_state = state
+            else:
+                self._state_dirty.set()  # Retry, e.g. the reader had the file open
+                time.sleep(0.5)
 
     def _start_level_monitor(self):
-        """Start a background thread to monitor mic level."""
-        def monitor():
-            def callback(indata, frames, time_info, status):
-                if indata is not None and len(indata) > 0:
-                    volume = self.volume.get()
-                    level = np.sqrt(np.mean(indata.astype(np.float32) ** 2)) * volume
-                    self.level_value = min(100, level * 500)
+        """
+        Start a background thread to monitor mic level.
+        The thread reads blocks with a blocking stream.read(), so no Python
+        runs on PortAudio's realtime thread and a GIL stall from Tk only
+        delays the meter instead of dropping audio.
+        """
+        def open_stream(settings):
+            return sd.RawInputStream(
+                samplerate=SAMPLE_RATE, channels=CHANNELS, dtype="int16",
+                blocksize=LEVEL_BLOCKSIZE, latency="low", **settings,
+            )
 
+        def monitor():
+            settings = input_stream_settings()
             try:
-                with sd.InputStream(
-                    samplerate=SAMPLE_RATE, channels=CHANNELS,
-                    dtype="int16", blocksize=1024, callback=callback
-                ):
-                    while True:
-                        sd.sleep(50)
+                try:
+                    stream = open_stream(settings)
+                except Exception as e:
+                    if not settings:
+                        raise
+                    # Driver rejected the WASAPI settings; the default device always opens
+                    logger.warning(f"WASAPI input failed, using default input: {e}")
+                    settings = {}
+                    stream = open_stream(settings)
+                with stream:
+                    host_api = "WASAPI" if settings else "default host API"
+                    logger.info(f"Level monitor on {host_api}, input latency {stream.latency * 1000:.0f} ms")
+                    while not self._monitor_stop.is_set():
+                        data, overflowed = stream.read(LEVEL_BLOCKSIZE)
+                        if overflowed:
+                            logger.warning("Level monitor input overflow")
+                        samples = np.frombuffer(data, dtype=np.int16)
+                        level = block_rms(samples, self._rms_scratch) * self._volume_cache
+                        self.level_value = min(100, level * 500)
+                        # Only wake the Tk loop when the bar would visibly move
+                        if abs(self.level_value - self._last_pushed_level) > 1:
+                            self._last_pushed_level = self.level_value
+                            self.root.event_generate("<<Level>>", when="tail")
             except Exception as e:
                 logger.error(f"Level monitor error: {e}")
 
+        self.root.bind("<<Level>>", lambda event: self.level_bar.configure(value=self.level_value))
         thread = threading.Thread(target=monitor, daemon=True)
         thread.start()
 
-        def update_meter():
-            self.level_bar["value"] = self.level_value
-            self.root.after(50, update_meter)
-
-        self.root.after(50, update_meter)
-
     def _minimize_to_tray(self):
         """Hide window and show system tray icon."""
         if not HAS_TRAY:
@@ -382,7 +518,7 @@ class MicControlPanel:
         self.root.withdraw()
         self.hidden = True
 
-        icon_image = create_tray_icon_image("green")
+        icon_image = TRAY_ICONS["green"]
         menu = pystray.Menu(
             pystray.MenuItem("Show", self._restore_from_tray),
             pystray.MenuItem("Quit", self._quit_from_tray),
@@ -416,6 +552,9 @@ class MicControlPanel:
     def _quit(self):
         """Clean shutdown."""
         logger.info("Mic panel shutting down")
+        if self._state_dirty.is_set():
+            save_mic_state(self._pending_state)  # Don't lose the last change
+        self._monitor_stop.set()
         if self.tray_icon:
             self.tray_icon.stop()
         self.root.destroy()
@@ -423,6 +562,7 @@ class MicControlPanel:
     def run(self):
         """Start the tkinter main loop."""
         logger.info("Mic Control Panel starting")
+        self.root.after(TICK_MS, self._tick)
         self.root.mainloop()
 
 
@@ -6,13 +6,16 @@ from the transcript and sends it to AllTalk TTS for audio playback.
 Used as a Claude Code Stop hook to auto-speak all responses.
 """
 import io
+import itertools
 import json
+import mmap
+import re
+import struct
 import sys
-import tempfile
+import threading
+import wave
 from pathlib import Path
 
-import time
-
 import numpy as np
 import requests
 import sounddevice as sd
@@ -20,23 +23,80 @@ import sounddevice as sd
 ALLTALK_URL = "http://127.0.0.1:7851"
 DEFAULT_VOICE = "Freya.wav"
 MAX_SPEAK_LENGTH = 2000  # Don't speak responses longer than this
+MIN_SPEAK_LENGTH = 20  # Don't speak what's left around code blocks if it's shorter than this
+MAX_CODE_FRACTION = 0.7  # Don't speak responses that are mostly code blocks
+TAIL_MAX_BYTES = 16 * 1024 * 1024  # Give up this far back in the transcript without an assistant entry
+STREAM_CHUNK_SIZE = 8192  # Bytes read from the TTS reply per write to the device
+PREROLL_SECONDS = 0.3  # Audio buffered before the device is opened, absorbs network jitter
+WAV_HEADER_MAX = 64 * 1024  # Stop looking for the WAV data chunk after this many bytes
 STATE_FILE = Path("F:/Apps/freedom_system/REPO_claude_code_voice_mode/mic_state.json")
 
+CODE_FENCE_RE = re.compile(r'```[\s\S]*?```')
+
+# Markdown stripped before speaking, applied in order
+MARKDOWN_RULES = [
+    (CODE_FENCE_RE, ' code block omitted '),
+    (re.compile(r'`[^`]+`'), ''),
+    (re.compile(r'\[([^\]]+)\]\([^)]+\)'), r'\1'),
+    (re.compile(r'[#*_~|>]'), ''),
+    (re.compile(r'\n+'), '. '),
+]
+
+
+# Last parsed tts_paused flag, keyed by the state file's mtime
+_state_cache = {"mtime": None, "paused": False}
+
 
 def is_tts_paused() -> bool:
-    """Check if TTS is paused by reading the shared state file."""
+    """Check if TTS is paused via the shared state file, re-reading only on change."""
     try:
-        state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
-        return state.get("tts_paused", False)
+        mtime = STATE_FILE.stat().st_mtime_ns
+        if mtime != _state_cache["mtime"]:
+            state = json.loads(STATE_FILE.read_text(encoding="utf-8"))
+            _state_cache["paused"] = state.get("tts_paused", False)
+            _state_cache["mtime"] = mtime
+        return _state_cache["paused"]
     except Exception:
+        _state_cache["mtime"] = None  # Missing or caught mid-write, re-read next call
         return False
 
 
+def _watch_pause(paused: threading.Event, done: threading.Event):
+    """Set paused once the mic panel pauses TTS; runs until done is set."""
+    while not done.wait(0.1):
+        if is_tts_paused():
+            paused.set()
+            return
+
+
+def _iter_lines_reversed(path: str):
+    """
+    Yield the lines of a file last-first. The file is memory-mapped, so only
+    the pages the backwards scan reaches are read.
+    """
+    with open(path, "rb") as f:
+        if f.seek(0, io.SEEK_END) == 0:
+            return  # mmap refuses empty files
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            end = len(mm)
+            limit = max(end - TAIL_MAX_BYTES, 0)
+            while True:
+                start = mm.rfind(b"\n", 0, end)
+                yield mm[start + 1:end]
+                if start < limit:  # Past the limit, or the first line is out
+                    return
+                end = start
+
+
 def get_last_assistant_message(transcript_path: str) -> str:
-    """Read the transcript JSONL file and extract the last assistant message."""
+    """
+    Extract the last assistant message from the transcript JSONL file.
+    Only the tail of the file is read, so long sessions cost the same.
+    """
     try:
-        lines = Path(transcript_path).read_text(encoding="utf-8").strip().split("\n")
-        for line in reversed(lines):
+        for line in _iter_lines_reversed(transcript_path):
+            if not line.strip():
+                continue
             try:
                 entry = json.loads(line)
                 if entry.get("role") == "assistant":
@@ -57,6 +117,138 @@ def get_last_assistant_message(transcript_path: str) -> str:
     return ""
 
 
+def _decode_pyav(data: bytes) -> np.ndarray:
+    """
+    Decode any container PyAV understands to mono float32 at 24 kHz.
+    Samples are scaled straight into one buffer sized from the container
+    duration, instead of collecting frames and concatenating.
+    """
+    import av  # Only needed for non-WAV replies; keeps FFmpeg out of hook start-up
+    container = av.open(io.BytesIO(data))
+    audio_stream = next(s for s in container.streams if s.type == "audio")
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=24000)
+    duration = container.duration or 0  # In av.time_base units; 0 if unknown
+    audio = np.empty(int(duration * 24000 / av.time_base) + 24000, dtype=np.float32)
+    pos = 0
+    for frame in container.decode(audio_stream):
+        for r in resampler.resample(frame):
+            pcm = r.to_ndarray().reshape(-1)
+            if pos + len(pcm) > len(audio):
+                audio = np.resize(audio, max(2 * len(audio), pos + len(pcm)))
+            np.multiply(pcm, np.float32(1.0 / 32768.0), out=audio[pos:pos + len(pcm)])
+            pos += len(pcm)
+    return audio[:pos]
+
+
+def _decode_audio(data: bytes) -> tuple[np.ndarray, int]:
+    """
+    Decode TTS audio to mono float32, returning (samples, samplerate).
+    AllTalk answers with 16-bit PCM WAV, which the stdlib reads without
+    FFmpeg; anything else goes through PyAV.
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wf:
+            if wf.getsampwidth() != 2:
+                raise wave.Error("not 16-bit PCM")
+            channels = wf.getnchannels()
+            samplerate = wf.getframerate()
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    except (wave.Error, EOFError):
+        return _decode_pyav(data), 24000
+    if channels > 1:
+        pcm = pcm[:len(pcm) - len(pcm) % channels].reshape(-1, channels).mean(axis=1)
+    # The output device resamples, so the WAV plays at its own rate
+    return np.multiply(pcm, np.float32(1.0 / 32768.0), dtype=np.float32), samplerate
+
+
+def _parse_wav_header(buf: bytes):
+    """
+    Return (channels, samplerate, data_offset) once buf holds a complete
+    16-bit PCM WAV header, or None if more bytes are needed.
+    Raises ValueError for anything that can't be streamed as raw PCM.
+    """
+    if len(buf) < 12:
+        return None
+    if buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise ValueError("not a WAV stream")
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id, size = struct.unpack_from("<4sI", buf, pos)
+        if chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            # The data size is ignored; streamed WAVs often leave it unset
+            return fmt + (pos + 8,)
+        if pos + 8 + size > len(buf):
+            break
+        if chunk_id == b"fmt ":
+            tag, channels, samplerate = struct.unpack_from("<HHI", buf, pos + 8)
+            bits = struct.unpack_from("<H", buf, pos + 22)[0]
+            if tag not in (1, 0xFFFE) or bits != 16:
+                raise ValueError("not 16-bit PCM")
+            fmt = (channels, samplerate)
+        pos += 8 + size + (size & 1)
+    if len(buf) > WAV_HEADER_MAX:
+        raise ValueError("no data chunk in WAV header")
+    return None
+
+
+def _play_response(response: requests.Response, paused: threading.Event):
+    """
+    Play a TTS reply. PCM WAV is written to the device as it downloads, so
+    playback starts after a short pre-roll; other formats are decoded whole.
+    """
+    chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+    head = bytearray()
+    header = None
+    try:
+        for chunk in chunks:
+            head += chunk
+            header = _parse_wav_header(head)
+            if header:
+                break
+    except ValueError:
+        pass
+
+    if header is None:
+        audio, samplerate = _decode_audio(head + b"".join(chunks))
+        if len(audio):
+            sd.play(audio, samplerate=samplerate)
+            if paused.wait(timeout=len(audio) / samplerate):
+                sd.stop()
+            else:
+                sd.wait()
+        return
+
+    channels, samplerate, offset = header
+    frame_bytes = 2 * channels
+    pending = head  # Bytes not yet written to the device
+    del pending[:offset]
+
+    # Buffer a little before opening the device, so a late chunk can't underrun it
+    preroll = int(PREROLL_SECONDS * samplerate) * frame_bytes
+    while len(pending) < preroll:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        pending += chunk
+        if paused.is_set():
+            return
+
+    with sd.RawOutputStream(samplerate=samplerate, channels=channels, dtype="int16") as stream:
+        for chunk in itertools.chain([b""], chunks):  # b"" flushes the pre-roll first
+            if paused.is_set():
+                stream.abort()  # Drop what's queued; closing would play it out
+                return
+            pending += chunk
+            usable = len(pending) - len(pending) % frame_bytes
+            if usable:
+                with memoryview(pending)[:usable] as view:
+                    stream.write(view)
+                del pending[:usable]
+
+
 def speak(text: str):
     """Send text to AllTalk and play audio."""
     if not text or len(text) > MAX_SPEAK_LENGTH:
@@ -64,20 +256,25 @@ def speak(text: str):
     if is_tts_paused():
         return
 
+    # Mostly-code responses would only come out as "code block omitted"
+    code_chars = sum(len(m.group(0)) for m in CODE_FENCE_RE.finditer(text))
+    if code_chars > MAX_CODE_FRACTION * len(text):
+        return
+
     # Strip markdown formatting for cleaner speech
-    import re
-    text = re.sub(r'```[\s\S]*?```', ' code block omitted ', text)
-    text = re.sub(r'`[^`]+`', '', text)
-    text = re.sub(r'\[([^\]]+)\]\([^)]+\)', r'\1', text)
-    text = re.sub(r'[#*_~|>]', '', text)
-    text = re.sub(r'\n+', '. ', text)
+    for pattern, replacement in MARKDOWN_RULES:
+        text = pattern.sub(replacement, text)
     text = text.strip()
 
-    if not text:
+    if not text or (code_chars and len(text) < MIN_SPEAK_LENGTH):
         return
 
+    # Watch for a pause from the start, so one during generation also counts
+    paused = threading.Event()
+    done = threading.Event()
+    threading.Thread(target=_watch_pause, args=(paused, done), daemon=True).start()
     try:
-        response = requests.post(
+        with requests.post(
             f"{ALLTALK_URL}/v1/audio/speech",
             json={
                 "input": text[:MAX_SPEAK_LENGTH],
@@ -85,35 +282,15 @@ def speak(text: str):
                 "model": "tts-1",
                 "response_format": "wav",
             },
+            stream=True,
             timeout=30,
-        )
-        if response.status_code == 200:
-            import av
-            buf = io.BytesIO(response.content)
-            container = av.open(buf)
-            audio_stream = next(s for s in container.streams if s.type == "audio")
-            frames = []
-            resampler = av.AudioResampler(format="s16", layout="mono", rate=24000)
-            for frame in container.decode(audio_stream):
-                resampled = resampler.resample(frame)
-                for r in resampled:
-                    frames.append(r.to_ndarray().flatten())
-            if frames:
-                audio = np.concatenate(frames).astype(np.float32) / 32768.0
-                sd.play(audio, samplerate=24000)
-                while True:
-                    try:
-                        stream = sd.get_stream()
-                        if not stream.active:
-                            break
-                    except RuntimeError:
-                        break
-                    if is_tts_paused():
-                        sd.stop()
-                        break
-                    time.sleep(0.1)
+        ) as response:
+            if response.status_code == 200:
+                _play_response(response, paused)
     except Exception:
         pass  # Don't block Claude on TTS failure
+    finally:
+        done.set()
 
 
 def main():